@@ -1,21 +1,27 @@
 import argparse
+import asyncio
+import hashlib
+import json
+import os
 import shutil
-import subprocess
 import sys
 import logging
+import time
 import yaml
 from pathlib import Path
 from datetime import datetime
-import sqlparse
 import csv
+import urllib.error
 import urllib.request  # >>> Added
+from lakebridge_common import CLI_WORKERS, DATABRICKS_BIN, check_cli, ensure_dirs, process_sql_files, run_cmd_async
+
+CONFIG_URL = "https://raw.githubusercontent.com/satyamhtek/LakeBridge/main/config.yaml"
 
 # -------------------------
 # Setup Logging (file only)
 # -------------------------
-def setup_logging(metadata_folder: Path):
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_file = metadata_folder / f"lakebridge_run_{ts}.txt"
+def setup_logging(metadata_folder: Path, run_ts: str):
+    log_file = metadata_folder / f"lakebridge_run_{run_ts}.txt"
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s [%(levelname)s] %(message)s",
@@ -29,112 +35,119 @@ def setup_logging(metadata_folder: Path):
 # -------------------------
 # Utility functions
 # -------------------------
-def check_cli():
-    if shutil.which("databricks") is None:
-        sys.exit("ERROR: 'databricks' CLI not found in PATH. Install/configure it and try again.")
+def fetch_config(config_path: Path, refresh=False):
+    """Download the default config if missing; with refresh, update it only when GitHub has a newer copy.
+
+    The download's ETag and content hash are kept in <config>.fetch.json. A config that no longer matches
+    that hash (edited locally, or not downloaded by this script) is never overwritten.
+    """
+    state_path = config_path.with_suffix(".fetch.json")
+    try:
+        state = json.loads(state_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        state = {}
 
-def ensure_dirs(folder: Path):
-    folder.mkdir(parents=True, exist_ok=True)
+    if config_path.exists():
+        # GitHub is checked at most once an hour
+        if not refresh or time.time() - state.get("checked_at", 0) < 3600:
+            return
+        if state.get("sha256") != hashlib.sha256(config_path.read_bytes()).hexdigest():
+            print(f"{config_path} has local changes, keeping it (delete it to download the GitHub copy)")
+            return
+        print(f"Checking GitHub for a newer {config_path}...")
+    else:
+        print(f"Config file {config_path} not found. Downloading from GitHub...")
 
-def run_cmd(cmd_str: str, title: str, log_file=None, ignore_failure=False):
-    print(f"\n=== {title} ===")
-    print("Command:", cmd_str)
+    req = urllib.request.Request(CONFIG_URL)
+    if config_path.exists() and state.get("etag"):
+        req.add_header("If-None-Match", state["etag"])
     try:
-        result = subprocess.run(cmd_str, shell=True, timeout=600)
-        if result.returncode != 0:
-            msg = f"{title} failed with exit code {result.returncode}"
-            if log_file:
-                with open(log_file, "a", encoding="utf-8") as f:
-                    f.write(msg + "\n")
-            if not ignore_failure:
-                sys.exit(msg)
-            return False
-        return True
-    except subprocess.TimeoutExpired:
-        msg = f"{title} timed out after 600 seconds"
-        if log_file:
-            with open(log_file, "a", encoding="utf-8") as f:
-                f.write(msg + "\n")
-        if not ignore_failure:
-            sys.exit(msg)
-        return False
-
-def validate_input_folder(source_path: Path):
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            data = resp.read()
+            etag = resp.headers.get("ETag")
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            error = e
+        else:
+            print(f"{config_path} is up to date")
+            state["checked_at"] = time.time()
+            state_path.write_text(json.dumps(state), encoding="utf-8")
+            return
+    except OSError as e:  # URLError, timeouts
+        error = e
+    else:
+        config_path.write_bytes(data)
+        state = {"etag": etag, "sha256": hashlib.sha256(data).hexdigest(), "checked_at": time.time()}
+        state_path.write_text(json.dumps(state), encoding="utf-8")
+        print(f"Downloaded default config to {config_path}")
+        return
+
+    if not config_path.exists():
+        sys.exit(f"ERROR: could not download {CONFIG_URL}: {error}")
+    print(f"⚠️ Could not check GitHub for a newer config ({error}); using {config_path}")
+
+def load_config(config_path: Path):
+    """Parse the YAML config, reusing a JSON copy while the file's mtime and size are unchanged."""
+    cache_path = config_path.with_suffix(".cache.json")
+    st = config_path.stat()
+    signature = [st.st_mtime_ns, st.st_size]
+    try:
+        cached = json.loads(cache_path.read_text(encoding="utf-8"))
+        if isinstance(cached, dict) and cached.get("signature") == signature:
+            return cached["config"]
+    except (OSError, ValueError):
+        pass  # missing or unreadable cache: fall back to parsing
+
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f)
+    try:
+        cache_path.write_text(json.dumps({"signature": signature, "config": config}), encoding="utf-8")
+    except (OSError, TypeError):
+        pass  # unwritable folder, or values JSON cannot hold (e.g. YAML dates): just parse again next run
+    return config
+
+def precreate_output_tree(target_path: Path, folders):
+    """Create every output folder of the run in one pass, including Final_Formatted used by post-processing."""
+    for folder in [*folders, target_path / "Final_Formatted"]:
+        folder.mkdir(parents=True, exist_ok=True)
+
+def validate_input_folder(source_path: Path, sql_files):
     if not source_path.exists():
         sys.exit(f"ERROR: source path not found: {source_path}")
-    if not any(source_path.glob("*.sql")):
+    if not sql_files:
         print(f"WARNING: No .sql files found in {source_path}")
 
-# -------------------------
-# SQL Post-processing + notebooks
-# -------------------------
-def process_sql_files(converted_folder: Path, notebooks_folder: Path, metadata_folder: Path):
-    final_folder = converted_folder.parent / "Final_Formatted"
-    ensure_dirs(final_folder)
-    ensure_dirs(notebooks_folder)
-    
-    summary = []
-
-    print("\nPost-processing SQL and generating notebooks started...")
-    for sql_file in converted_folder.glob("*.sql"):
-        status = "Succeeded"
+def stage_sql_files(sql_files, staging_folder: Path):
+    """Link the given SQL files into a fresh staging folder so one transpile call can take them all."""
+    if staging_folder.exists():
+        shutil.rmtree(staging_folder)
+    ensure_dirs(staging_folder)
+    for sql_file in sql_files:
+        staged_file = staging_folder / sql_file.name
         try:
-            with open(sql_file, "r", encoding="utf-8", errors="replace") as f:
-                sql_content = f.read()
-            
-            # 🎨 Format SQL
-            sql_content = sqlparse.format(sql_content, reindent=True, keyword_case="upper")
-
-            # Save to Final_Formatted
-            final_file = final_folder / sql_file.name
-            with open(final_file, "w", encoding="utf-8") as f:
-                f.write(sql_content)
-
-            # Create Databricks notebook (.py)
-            notebook_file = notebooks_folder / (sql_file.stem + ".py")
-            with open(notebook_file, "w", encoding="utf-8") as f:
-                f.write("# Databricks notebook source\n")
-                f.write(f'"""\nAuto-generated from {sql_file.name}\n"""\n\n')
-                f.write('sql_query = """\n')
-                f.write(sql_content)
-                f.write('\n"""\n')
-                f.write("display(spark.sql(sql_query))\n")
-
-            # Upload notebook to Databricks (ignore failures here)
-            upload_cmd = (
-                f'databricks workspace import '
-                f'--file "{notebook_file}" '
-                f'"/Shared/{notebook_file.name}" '
-                f'--language PYTHON --overwrite'
-            )
-            run_cmd(upload_cmd, f"Upload Notebook {notebook_file.name}", log_file=metadata_folder / f"lakebridge_run_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt", ignore_failure=True)
-
-        except Exception as e:
-            status = f"Failed: {e}"
-            logging.error(f"Error processing {sql_file.name}: {e}")
-        
-        summary.append((sql_file.name, status))
-
-    return summary
+            os.symlink(sql_file.resolve(), staged_file)
+        except OSError:
+            # Symlinks need extra privileges on Windows; fall back to a plain copy
+            shutil.copy2(sql_file, staged_file)
 
 # -------------------------
 # Main function
 # -------------------------
-def main():
+async def main():
     parser = argparse.ArgumentParser(description="Run Lakebridge Analyze and Convert (Transpile) commands.")
     parser.add_argument("--config", default="config.yaml", help="Path to YAML config file")  # >>> changed default
+    parser.add_argument("--refresh-config", action="store_true",
+                        help="Replace a downloaded, unedited config with the GitHub copy if that copy is newer "
+                             "(checked at most hourly)")
+    parser.add_argument("--force-upload", action="store_true",
+                        help="Re-upload every notebook, including files already uploaded unchanged")
     args = parser.parse_args()
 
     # >>> Added: auto-download config.yaml if not found
     config_path = Path(args.config)
-    if not config_path.exists():
-        print(f"Config file {config_path} not found. Downloading from GitHub...")
-        url = "https://raw.githubusercontent.com/satyamhtek/LakeBridge/main/config.yaml"
-        urllib.request.urlretrieve(url, config_path)
-        print(f"Downloaded default config to {config_path}")
+    fetch_config(config_path, refresh=args.refresh_config)
 
-    with open(config_path, "r") as f:
-        config = yaml.safe_load(f)
+    config = load_config(config_path)
 
     source_path = Path(config["source_path"])
     target_path = Path(config["target_path"])
@@ -151,20 +164,29 @@ def main():
         sys.exit(0)
     # <<< END ADDED
 
-    ts_folder = datetime.now().strftime("%Y%m%d")
+    # One timestamp for the whole run keeps the log, report and summary names consistent
+    run_start = datetime.now()
+    run_ts = run_start.strftime("%Y%m%d_%H%M%S")
+    ts_folder = run_start.strftime("%Y%m%d")
     metadata_folder = target_path / "metadata" / ts_folder
-    ensure_dirs(metadata_folder)
-    log_file = setup_logging(metadata_folder)
+    analyzer_output_folder = target_path / "analyzer_output"
+    converted_folder = target_path / "Converted_Code"
+    notebooks_folder = target_path / "Databricks_Notebooks"
+    precreate_output_tree(target_path, [metadata_folder, analyzer_output_folder, converted_folder, notebooks_folder])
+    setup_logging(metadata_folder, run_ts)
+
+    # Single directory scan, reused by validation, analyzer status and transpile
+    source_sql_files = sorted(source_path.glob("*.sql"))
 
     print("\nLakebridge script started\n")
     check_cli()
     if run_validation:
-        validate_input_folder(source_path)
+        validate_input_folder(source_path, source_sql_files)
 
-    analyzer_output_folder = target_path / "analyzer_output"
-    ensure_dirs(analyzer_output_folder)
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    analyzer_report_file = analyzer_output_folder / f"lakebridge_analysis_{ts}.xlsx"
+    analyzer_report_file = analyzer_output_folder / f"lakebridge_analysis_{run_ts}.xlsx"
+
+    # Caps concurrent databricks CLI processes
+    cli_limit = asyncio.Semaphore(config.get("transpile_workers", CLI_WORKERS))
 
     global_flags = []
     if profile:
@@ -176,70 +198,134 @@ def main():
     # 1️⃣ Analyzer (single run, track per file)
     # -------------------------
     analyzer_status_dict = {}
+    analyze_task = None
     try:
         if run_analyzer:  # <<< ADDED
-            analyze_cmd_parts = [
-                "databricks labs lakebridge analyze",
-                f'--source-directory "{source_path}"',
-                f'--report-file "{analyzer_report_file}"',
-                f'--source-tech {dialect}',
-            ] + global_flags
-            run_cmd(" ".join(analyze_cmd_parts), "Lakebridge Analyze", log_file=log_file)
-            for sql_file in source_path.glob("*.sql"):
-                analyzer_status_dict[sql_file.name] = "Success"
+            analyze_argv = [
+                DATABRICKS_BIN, "labs", "lakebridge", "analyze",
+                "--source-directory", str(source_path),
+                "--report-file", str(analyzer_report_file),
+                "--source-tech", dialect,
+                *global_flags,
+            ]
+            if run_transpiler and config.get("pipeline_overlap", True):
+                # Analyzer and transpiler touch disjoint outputs, so the analyzer runs while transpile proceeds.
+                # Its transpile work is already under way by the time it could fail, so failure is recorded, not fatal.
+                analyze_task = asyncio.create_task(
+                    run_cmd_async(analyze_argv, "Lakebridge Analyze", cli_limit, ignore_failure=True)
+                )
+            else:
+                await run_cmd_async(analyze_argv, "Lakebridge Analyze", cli_limit)
+                for sql_file in source_sql_files:
+                    analyzer_status_dict[sql_file.name] = "Success"
     except Exception as e:
         logging.error(f"Analyzer failed: {e}")
-        for sql_file in source_path.glob("*.sql"):
+        for sql_file in source_sql_files:
             analyzer_status_dict[sql_file.name] = "Failed"
 
     # -------------------------
-    # 2️⃣ Transpiler (file by file)
+    # 2️⃣ Transpiler (batch, or file by file)
     # -------------------------
-    converted_folder = target_path / "Converted_Code"
-    ensure_dirs(converted_folder)
-
     transpile_status_dict = {}
     if run_transpiler:  # <<< ADDED
-        print("\nStarting transpile per SQL file...")
-        for sql_file in source_path.glob("*.sql"):
+        async def _transpile_one(sql_file: Path) -> tuple[str, bool]:
+            transpile_argv = [
+                DATABRICKS_BIN, "labs", "lakebridge", "transpile",
+                "--input-source", str(sql_file),
+                "--source-dialect", dialect.lower(),
+                "--output-folder", str(converted_folder),
+                *global_flags,
+            ]
+            success, _, _ = await run_cmd_async(transpile_argv, f"Transpile {sql_file.name}", cli_limit, ignore_failure=True)
+            return sql_file.name, success
+
+        if not source_sql_files:
+            print("\nNo SQL files to transpile")
+        elif config.get("transpile_batch", True):
+            # One CLI invocation for the whole folder amortizes CLI startup over all files
+            print(f"\nStarting batch transpile of {len(source_sql_files)} SQL files...")
+            # The whole folder gets the time the per-file calls would have had (600 s each) unless configured
+            batch_timeout = config.get("transpile_batch_timeout", 600 * len(source_sql_files))
+            staging_folder = target_path / "_transpile_stage"
             try:
-                transpile_cmd_parts = [
-                    "databricks labs lakebridge transpile",
-                    f'--input-source "{sql_file}"',
-                    f'--source-dialect {dialect.lower()}',
-                    f'--output-folder "{converted_folder}"',
-                ] + global_flags
-                success = run_cmd(" ".join(transpile_cmd_parts), f"Transpile {sql_file.name}", log_file=log_file, ignore_failure=True)
-                transpile_status_dict[sql_file.name] = "Success" if success else "Failed"
+                stage_sql_files(source_sql_files, staging_folder)
+                started_at = time.time()
+                transpile_argv = [
+                    DATABRICKS_BIN, "labs", "lakebridge", "transpile",
+                    "--input-source", str(staging_folder),
+                    "--source-dialect", dialect.lower(),
+                    "--output-folder", str(converted_folder),
+                    *global_flags,
+                ]
+                await run_cmd_async(
+                    transpile_argv, "Transpile (batch)", cli_limit, timeout=batch_timeout, ignore_failure=True,
+                )
+                for sql_file in source_sql_files:
+                    output_file = converted_folder / sql_file.name
+                    # Only outputs written by this run count; older files may be left over from a previous run
+                    success = output_file.exists() and output_file.stat().st_mtime >= started_at - 1
+                    transpile_status_dict[sql_file.name] = "Success" if success else "Failed"
             except Exception as e:
-                logging.error(f"Transpile failed for {sql_file.name}: {e}")
-                transpile_status_dict[sql_file.name] = "Failed"
+                logging.error(f"Batch transpile failed: {e}")
+                for sql_file in source_sql_files:
+                    transpile_status_dict.setdefault(sql_file.name, "Failed")
+            finally:
+                shutil.rmtree(staging_folder, ignore_errors=True)
+        else:
+            print("\nStarting transpile per SQL file...")
+            results = await asyncio.gather(
+                *(_transpile_one(sql_file) for sql_file in source_sql_files), return_exceptions=True,
+            )
+            for sql_file, result in zip(source_sql_files, results):
+                if isinstance(result, Exception):
+                    logging.error(f"Transpile failed for {sql_file.name}: {result}")
+                    transpile_status_dict[sql_file.name] = "Failed"
+                else:
+                    name, success = result
+                    transpile_status_dict[name] = "Success" if success else "Failed"
 
     # -------------------------
     # 3️⃣ Post-process SQL + generate notebooks
     # -------------------------
-    notebooks_folder = target_path / "Databricks_Notebooks"
-    post_process_summary = process_sql_files(converted_folder, notebooks_folder, metadata_folder) if run_transpiler else []  # <<< ADDED
+    # CPU-bound formatting and blocking uploads run off the event loop
+    # The cache sits in the metadata root rather than the dated folder, so it carries over between days
+    format_cache_file = target_path / "metadata" / "format_cache.json"
+    post_process_summary = await asyncio.to_thread(
+        process_sql_files, converted_folder, notebooks_folder,
+        format_cache_file=format_cache_file, dirs_ready=True, force_upload=args.force_upload,
+    ) if run_transpiler else []  # <<< ADDED
+
+    if analyze_task is not None:
+        try:
+            analyzer_ok, _, _ = await analyze_task
+        except Exception as e:
+            logging.error(f"Analyzer failed: {e}")
+            analyzer_ok = False
+        for sql_file in source_sql_files:
+            analyzer_status_dict[sql_file.name] = "Success" if analyzer_ok else "Failed"
 
     # -------------------------
     # 4️⃣ Write combined CSV summary
     # -------------------------
-    summary_file = metadata_folder / f"sql_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    with open(summary_file, "w", newline="", encoding="utf-8") as csvfile:
+    summary_file = metadata_folder / f"sql_summary_{run_ts}.csv"
+    with open(summary_file, "w", newline="", encoding="utf-8", buffering=1 << 20) as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["Script Name", "Analyzer Status", "Transpile Status", "Post-process Status"])
-        all_files = set(list(analyzer_status_dict.keys()) + list(transpile_status_dict.keys()))
+        # Sorted so the summary is stable from run to run
+        all_files = sorted(analyzer_status_dict.keys() | transpile_status_dict.keys())
         post_process_dict = dict(post_process_summary)
-        for file_name in all_files:
-            writer.writerow([
+        writer.writerows(
+            (
                 file_name,
                 analyzer_status_dict.get(file_name, "Skipped" if not run_analyzer else "Failed"),  # <<< ADDED
                 transpile_status_dict.get(file_name, "Skipped" if not run_transpiler else "Failed"),  # <<< ADDED
                 post_process_dict.get(file_name, "Skipped" if not run_transpiler else "Failed"),  # <<< ADDED
-            ])
+            )
+            for file_name in all_files
+        )
     print(f"\nAll tasks completed. Summary CSV saved at {summary_file}")
 
     sys.exit(0)
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,421 @@
+import asyncio
+import codecs
+import configparser
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import repeat
+from pathlib import Path
+import sqlparse
+
+try:
+    from blake3 import blake3 as _content_hasher  # optional, faster on large files
+except ImportError:
+    _content_hasher = hashlib.sha256
+
+# Shared by 101_htutlis_dbx_runner.py and ssis/lakebridge_analyze_transpile_ssis.py
+
+# Resolved once; every CLI call execs this binary directly instead of going through a shell
+DATABRICKS_BIN = shutil.which("databricks")
+
+# Default cap on concurrent databricks CLI calls (config.yaml transpile_workers, SSIS --workers)
+CLI_WORKERS = 8
+
+# Formatting options applied to every converted script
+SQLPARSE_FORMAT_KWARGS = {"reindent": True, "keyword_case": "upper"}
+
+# Files above this size (bytes) are formatted one statement at a time, so only one statement's token tree is built at once
+STREAM_FORMAT_THRESHOLD = 1_000_000
+
+# Write buffer for formatted SQL and notebook files
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Statements up to this many characters are memoized when a large file is formatted statement by statement.
+# With the 256-entry memo below, that bounds it to about 1M characters of input, plus their output, per process.
+STATEMENT_MEMO_MAX_CHARS = 4 * 1024
+
+# Serializes console output from concurrent run_cmd calls
+_print_lock = threading.Lock()
+
+# Final_Formatted path -> {"key", "mtime_ns", "uploaded"}; set per worker by _init_format_cache
+_format_cache = {}
+
+# Content key -> Final_Formatted paths holding that content, built from _format_cache
+_paths_by_key = {}
+
+# Upload target whose already uploaded, unchanged files are skipped; None disables skipping
+_skip_upload_target = None
+
+# -------------------------
+# Utility functions
+# -------------------------
+def check_cli():
+    if DATABRICKS_BIN is None:
+        sys.exit("ERROR: 'databricks' CLI not found in PATH. Install/configure it and try again.")
+
+def ensure_dirs(folder: Path):
+    folder.mkdir(parents=True, exist_ok=True)
+
+def run_cmd(argv: list[str], title: str, ignore_failure=False, timeout=600):
+    with _print_lock:
+        print(f"\n=== {title} ===")
+        print("Command:", subprocess.list2cmdline(argv))
+    try:
+        result = subprocess.run(argv, shell=False, timeout=timeout)
+        if result.returncode != 0:
+            msg = f"{title} failed with exit code {result.returncode}"
+            logging.error(msg)
+            if not ignore_failure:
+                sys.exit(msg)
+            return False
+        return True
+    except subprocess.TimeoutExpired:
+        msg = f"{title} timed out after {timeout} seconds"
+        logging.error(msg)
+        if not ignore_failure:
+            sys.exit(msg)
+        with _print_lock:
+            print(f"⚠️ {msg}")
+        return False
+
+async def run_cmd_async(argv: list[str], title: str, limit: asyncio.Semaphore, timeout=600, ignore_failure=False,
+                        capture_output=False) -> tuple[bool, str, str]:
+    """Async counterpart of run_cmd; `limit` caps how many CLI processes run at once.
+
+    By default output is echoed as it arrives (long analyzer runs stay visible) and written to the run log;
+    with capture_output stdout and stderr are collected separately instead. Returns (success, stdout, error),
+    where error is the captured stderr or, on failure, the failure message.
+    """
+    async with limit:
+        print(f"\n=== {title} ===")
+        print("Command:", subprocess.list2cmdline(argv))
+        proc = await asyncio.create_subprocess_exec(
+            *argv,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE if capture_output else asyncio.subprocess.STDOUT,
+        )
+        chunks = []
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        async def _tee():
+            while chunk := await proc.stdout.read(64 * 1024):
+                text = decoder.decode(chunk)
+                sys.stdout.write(text)
+                sys.stdout.flush()
+                chunks.append(text)
+            await proc.wait()
+
+        try:
+            if capture_output:
+                out, err = await asyncio.wait_for(proc.communicate(), timeout)
+                stdout, stderr = out.decode(errors="replace"), err.decode(errors="replace")
+            else:
+                await asyncio.wait_for(_tee(), timeout)
+                stdout, stderr = "".join(chunks), ""
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            msg = f"{title} timed out after {timeout} seconds"
+            logging.error(msg)
+            if not ignore_failure:
+                sys.exit(msg)
+            return False, "", msg
+
+    if not capture_output and stdout.strip():
+        logging.info(f"{title} output:\n{stdout.strip()}")
+    if proc.returncode != 0:
+        msg = f"{title} failed with exit code {proc.returncode}"
+        logging.error(msg)
+        if not ignore_failure:
+            sys.exit(msg)
+        return False, stdout, stderr.strip() or msg
+    return True, stdout, stderr
+
+# -------------------------
+# SQL Post-processing + notebooks
+# -------------------------
+def format_sql(sql_content: str) -> str:
+    return sqlparse.format(sql_content, **SQLPARSE_FORMAT_KWARGS)
+
+@functools.lru_cache(maxsize=256)
+def _format_statement_memo(statement: str) -> str:
+    return format_sql(statement)
+
+def _format_statement(statement: str) -> str:
+    # Generated scripts repeat short boilerplate statements, so those are formatted once per process.
+    # Whole files are not memoized here; unchanged files are already covered by the persistent format cache.
+    if len(statement) <= STATEMENT_MEMO_MAX_CHARS:
+        return _format_statement_memo(statement)
+    return format_sql(statement)
+
+def _format_stream(in_path: Path, out_path: Path):
+    """Format a large SQL file statement by statement, writing each one out as soon as it is formatted.
+
+    sqlparse's lexer reads the whole input text into memory; what this bounds is the parse tree, which is
+    built for one statement at a time instead of for the whole file.
+    """
+    with open(in_path, "r", encoding="utf-8", errors="replace") as fin, \
+            open(out_path, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as fout:
+        separator = ""
+        for stmt in sqlparse.parsestream(fin):
+            # str(stmt) keeps its own terminating ";", so only a blank line is added between statements
+            formatted = _format_statement(str(stmt)).strip()
+            if formatted:
+                fout.write(separator + formatted)
+                separator = "\n\n"
+
+def write_notebook(notebook_file: Path, source_name: str, sql_path: Path):
+    """Write a Databricks notebook running the SQL in `sql_path`, copying the file's bytes straight into the body."""
+    with open(notebook_file, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as f:
+        f.write(
+            "# Databricks notebook source\n"
+            f'"""\nAuto-generated from {source_name}\n"""\n\n'
+            'sql_query = """\n'
+        )
+        f.flush()
+        with open(sql_path, "rb") as src:
+            shutil.copyfileobj(src, f.buffer, 64 * 1024)
+        f.write('\n"""\ndisplay(spark.sql(sql_query))\n')
+
+def _content_key(sql_file: Path) -> str:
+    """Cache key for a converted file: its content hash plus the sqlparse version that formats it."""
+    hasher = _content_hasher()
+    with open(sql_file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    return f"{sqlparse.__version__}:{hasher.hexdigest()}"
+
+def _load_json_cache(cache_file: Path) -> dict:
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _init_format_cache(cache: dict, skip_upload_target: str = None):
+    global _format_cache, _paths_by_key, _skip_upload_target
+    _format_cache = cache
+    _paths_by_key = {}
+    for path, entry in cache.items():
+        _paths_by_key.setdefault(entry["key"], []).append(path)
+    _skip_upload_target = skip_upload_target
+
+def _is_current(path: str) -> bool:
+    # A formatted file edited after it was cached no longer matches its key
+    try:
+        return os.stat(path).st_mtime_ns == _format_cache[path]["mtime_ns"]
+    except OSError:
+        return False
+
+def _cached_formatted_file(key: str, final_file: Path):
+    """An up-to-date formatted file with content `key`, preferring final_file itself."""
+    paths = _paths_by_key.get(key, [])
+    if str(final_file) in paths:
+        paths = [str(final_file)] + [path for path in paths if path != str(final_file)]
+    for path in paths:
+        if _is_current(path):
+            return Path(path)
+    return None
+
+def _format_one(sql_file: Path, final_folder: Path, notebooks_folder: Path) -> tuple[str, str, str]:
+    """Format one converted SQL file and write its Final_Formatted copy and notebook.
+
+    Runs in a worker process, so failures are returned as a status instead of logged here.
+    Returns (name, status, content key).
+    """
+    key = None
+    try:
+        final_file = final_folder / sql_file.name
+        notebook_file = notebooks_folder / (sql_file.stem + ".py")
+        key = _content_key(sql_file)
+        cached_file = _cached_formatted_file(key, final_file)
+        if (cached_file == final_file and _skip_upload_target is not None
+                and _skip_upload_target in _format_cache[str(final_file)].get("uploaded", ())):
+            # Same content already formatted and uploaded under this name: nothing to write or upload
+            return sql_file.name, "Unchanged", key
+        if cached_file is not None:
+            # Same input already formatted by an earlier run: reuse it and skip sqlparse
+            if cached_file != final_file:
+                shutil.copy2(cached_file, final_file)
+        elif sql_file.stat().st_size > STREAM_FORMAT_THRESHOLD:
+            # 🎨 Format SQL statement by statement (one parse tree at a time), straight into Final_Formatted
+            _format_stream(sql_file, final_file)
+        else:
+            with open(sql_file, "r", encoding="utf-8", errors="replace") as f:
+                sql_content = f.read()
+
+            # 🎨 Format SQL
+            sql_content = format_sql(sql_content)
+
+            # Save to Final_Formatted
+            with open(final_file, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as f:
+                f.write(sql_content)
+
+        # Create Databricks notebook (.py), its body copied from the Final_Formatted file
+        write_notebook(notebook_file, sql_file.name, final_file)
+    except Exception as e:
+        return sql_file.name, f"Failed: {e}", key
+    return sql_file.name, "Succeeded", key
+
+def format_and_write_notebooks(converted_folder: Path, notebooks_folder: Path, sql_files=None, format_cache: dict = None,
+                               dirs_ready=False, skip_upload_target: str = None):
+    """Format converted files and write their notebooks, updating `format_cache` in place.
+
+    Returns (summary, {notebook_file: Final_Formatted path}) for the notebooks written.
+    """
+    final_folder = converted_folder.parent / "Final_Formatted"
+    if not dirs_ready:
+        ensure_dirs(final_folder)
+        ensure_dirs(notebooks_folder)
+
+    if sql_files is None:
+        sql_files = sorted(converted_folder.glob("*.sql"))
+
+    if format_cache is None:
+        format_cache = {}
+
+    print("\nPost-processing SQL and generating notebooks started...")
+    if len(sql_files) > 1:
+        # sqlparse is pure Python, so formatting is spread across processes rather than threads
+        with ProcessPoolExecutor(
+            max_workers=os.cpu_count(), initializer=_init_format_cache, initargs=(format_cache, skip_upload_target),
+        ) as executor:
+            results = list(executor.map(
+                _format_one, sql_files, repeat(final_folder), repeat(notebooks_folder), chunksize=8,
+            ))
+    else:
+        _init_format_cache(format_cache, skip_upload_target)
+        results = [_format_one(sql_file, final_folder, notebooks_folder) for sql_file in sql_files]
+
+    summary = []
+    notebook_files = {}
+    for sql_file, (name, status, key) in zip(sql_files, results):
+        summary.append((name, status))
+        if status == "Succeeded":
+            final_file = str(final_folder / sql_file.name)
+            notebook_files[notebooks_folder / (sql_file.stem + ".py")] = final_file
+            # One entry per formatted file; its recorded uploads stay valid only while its content is unchanged
+            previous = format_cache.get(final_file, {})
+            format_cache[final_file] = {"key": key, "mtime_ns": os.stat(final_file).st_mtime_ns}
+            if previous.get("key") == key and previous.get("uploaded"):
+                format_cache[final_file]["uploaded"] = previous["uploaded"]
+        elif status != "Unchanged":
+            logging.error(f"Error processing {name}: {status}")
+
+    unchanged = sum(status == "Unchanged" for _, status in summary)
+    if unchanged:
+        print(f"Skipped {unchanged} unchanged SQL files already uploaded")
+
+    return summary, notebook_files
+
+def upload_notebook(notebook_file: Path) -> tuple[bool, str]:
+    """Upload one notebook; returns (success, error text) instead of exiting so it can run in a pool."""
+    upload_argv = [
+        DATABRICKS_BIN, "workspace", "import",
+        "--file", str(notebook_file),
+        f"/Shared/{notebook_file.name}",
+        "--language", "PYTHON", "--overwrite",
+    ]
+    try:
+        result = subprocess.run(upload_argv, shell=False, timeout=600, capture_output=True, text=True)
+    except subprocess.TimeoutExpired:
+        return False, "timed out after 600 seconds"
+    if result.returncode != 0:
+        return False, result.stderr.strip() or f"exit code {result.returncode}"
+    return True, ""
+
+def upload_target() -> str:
+    """Where notebooks are uploaded: the workspace host the databricks CLI resolves to, plus /Shared.
+
+    Mirrors the CLI's own lookup (DATABRICKS_HOST, else the host of DATABRICKS_CONFIG_PROFILE or DEFAULT).
+    """
+    host = os.environ.get("DATABRICKS_HOST")
+    if not host:
+        profile = os.environ.get("DATABRICKS_CONFIG_PROFILE", "DEFAULT")
+        config = configparser.ConfigParser()
+        config.read(os.environ.get("DATABRICKS_CONFIG_FILE", Path.home() / ".databrickscfg"))
+        host = config.get(profile, "host", fallback=f"profile:{profile}")
+    return f"{host.rstrip('/')}/Shared"
+
+def _import_dir(folder: Path, notebook_count: int) -> bool:
+    # One import-dir call uploads the whole folder; notebooks carry the "# Databricks notebook source" header
+    import_dir_argv = [DATABRICKS_BIN, "workspace", "import-dir", str(folder), "/Shared", "--overwrite"]
+    # It gets the time the per-notebook uploads would have had (600 s each)
+    return run_cmd(import_dir_argv, "Upload Notebooks (import-dir)", ignore_failure=True, timeout=600 * notebook_count)
+
+def upload_notebooks_bulk(notebooks_folder: Path, notebook_files) -> dict:
+    """Upload exactly `notebook_files` to /Shared/<notebook>.py, returning {notebook_file: success}."""
+    # Only these notebooks are staged (as hard links), so leftovers in notebooks_folder are never uploaded.
+    # import-dir drops a notebook's extension, so each link gets a second ".py" and lands at /Shared/<notebook>.py,
+    # the same path upload_notebook uses.
+    with tempfile.TemporaryDirectory(prefix="_upload_stage_", dir=notebooks_folder.parent) as stage_dir:
+        for notebook_file in notebook_files:
+            staged_file = Path(stage_dir) / (notebook_file.name + ".py")
+            try:
+                os.link(notebook_file, staged_file)
+            except OSError:
+                shutil.copy2(notebook_file, staged_file)
+        uploaded = _import_dir(Path(stage_dir), len(notebook_files))
+    if uploaded:
+        return dict.fromkeys(notebook_files, True)
+
+    print("\nBulk upload failed, falling back to per-notebook upload...")
+    upload_status = {}
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        futures = {executor.submit(upload_notebook, notebook_file): notebook_file for notebook_file in notebook_files}
+        for future in as_completed(futures):
+            notebook_file = futures[future]
+            success, error = future.result()
+            upload_status[notebook_file] = success
+            if not success:
+                # Reported as each upload lands rather than after the whole batch
+                msg = f"Upload Notebook {notebook_file.name} failed: {error}"
+                logging.error(msg)
+                with _print_lock:
+                    print(f"⚠️ {msg}")
+    return upload_status
+
+def process_sql_files(converted_folder: Path, notebooks_folder: Path, sql_files=None,
+                      format_cache_file: Path = None, dirs_ready=False, force_upload=False):
+    """Format converted files, write their notebooks and upload them to /Shared.
+
+    With a format_cache_file, files whose content was already formatted and uploaded to the same
+    workspace are reported as "Unchanged" and skipped; force_upload re-uploads them anyway.
+    """
+    format_cache = _load_json_cache(format_cache_file) if format_cache_file else {}
+    # Entries from the older content-keyed layout are dropped; those files are simply formatted again
+    format_cache = {path: entry for path, entry in format_cache.items() if isinstance(entry, dict) and "key" in entry}
+    target = upload_target()
+
+    summary, notebook_files = format_and_write_notebooks(
+        converted_folder, notebooks_folder, sql_files, format_cache, dirs_ready,
+        skip_upload_target=None if force_upload or not format_cache_file else target,
+    )
+
+    # Upload notebooks to Databricks; failures are reported per file instead of stopping the run
+    if notebook_files:
+        upload_status = upload_notebooks_bulk(notebooks_folder, list(notebook_files))
+        notebook_to_name = {notebooks_folder / (Path(name).stem + ".py"): name for name, _ in summary}
+        failed_uploads = {notebook_to_name[nb] for nb, success in upload_status.items() if not success}
+        summary = [(name, "Upload failed" if name in failed_uploads else status) for name, status in summary]
+
+        # Only successful uploads are recorded, so anything that failed is retried next run
+        for notebook_file, success in upload_status.items():
+            entry = format_cache[notebook_files[notebook_file]]
+            if success and target not in entry.setdefault("uploaded", []):
+                entry["uploaded"].append(target)
+
+    if format_cache_file:
+        with open(format_cache_file, "w", encoding="utf-8") as f:
+            json.dump(format_cache, f)
+
+    return summary
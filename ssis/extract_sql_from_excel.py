@@ -1,67 +1,101 @@
 import os
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import openpyxl
 
-# --- USER INPUT ---
-input_folder = input("Enter the path to the folder containing the Excel (.xlsx) files: ").strip('"').strip()
-output_root_folder = input("Enter the path to the output folder where SQL files should be saved: ").strip('"').strip()
-
-# Validate input folder
-if not os.path.exists(input_folder):
-    print(f"❌ ERROR: Input folder not found: {input_folder}")
-    exit(1)
-
-# Create output root folder if it doesn't exist
-os.makedirs(output_root_folder, exist_ok=True)
+# Characters not allowed in output file names, all mapped to "_" in one translate pass
+_FNAME_TRANS = str.maketrans({" ": "_", "/": "_", "\\": "_", ":": "_"})
 
 # Helper: Create unique filename in case of name conflicts
-def get_unique_filename(base_dir, base_name, ext):
-    full_path = os.path.join(base_dir, f"{base_name}.{ext}")
+# `used` holds the (normcased) names already taken in base_dir, so no filesystem check is needed per candidate
+def get_unique_filename(base_dir, base_name, ext, used):
+    file_name = f"{base_name}.{ext}"
     counter = 1
-    while os.path.exists(full_path):
-        full_path = os.path.join(base_dir, f"{base_name}_{counter}.{ext}")
+    while os.path.normcase(file_name) in used:
+        file_name = f"{base_name}_{counter}.{ext}"
         counter += 1
-    return full_path
+    used.add(os.path.normcase(file_name))
+    return os.path.join(base_dir, file_name)
 
-# Process each Excel file
-for filename in os.listdir(input_folder):
-    if filename.endswith(".xlsx"):
-        file_path = os.path.join(input_folder, filename)
-        print(f"\n📄 Processing file: {filename}")
+# Process one Excel file; runs in a worker process and returns its log lines so output stays grouped per file
+def _process_xlsx(file_path, output_root_folder):
+    filename = os.path.basename(file_path)
+    messages = [f"\n📄 Processing file: {filename}"]
 
-        # Try to read the "SQL Statements" sheet
-        try:
-            df = pd.read_excel(file_path, sheet_name="SQL Statements", engine='openpyxl', dtype=str)
-        except Exception as e:
-            print(f"  ⚠️ Skipping (can't read 'SQL Statements'): {e}")
-            continue
+    # Try to open the "SQL Statements" sheet; read-only mode streams rows instead of loading the whole workbook
+    try:
+        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    except Exception as e:
+        messages.append(f"  ⚠️ Skipping (can't read 'SQL Statements'): {e}")
+        return messages
+
+    try:
+        if "SQL Statements" not in wb.sheetnames:
+            messages.append("  ⚠️ Skipping (can't read 'SQL Statements'): Worksheet named 'SQL Statements' not found")
+            return messages
+        rows = wb["SQL Statements"].iter_rows(values_only=True)
+        header = next(rows, ())
 
         # Check required columns
-        if not all(col in df.columns for col in ["Item Name", "SQL"]):
-            print(f"  ⚠️ Skipping (missing 'Item Name' or 'SQL' columns)")
-            continue
+        if "Item Name" not in header or "SQL" not in header:
+            messages.append("  ⚠️ Skipping (missing 'Item Name' or 'SQL' columns)")
+            return messages
+        name_idx = header.index("Item Name")
+        sql_idx = header.index("SQL")
 
         # Create subfolder for this DTSX (xlsx) file
         xlsx_name = os.path.splitext(filename)[0]
         package_output_folder = os.path.join(output_root_folder, xlsx_name)
         os.makedirs(package_output_folder, exist_ok=True)
+        used = {os.path.normcase(name) for name in os.listdir(package_output_folder)}
 
         # Write each SQL block to a separate file
-        for idx, row in df.iterrows():
-            item_name = str(row.get("Item Name", "")).strip()
-            sql = str(row.get("SQL", "")).strip()
+        for row in rows:
+            # Rows can be shorter than the header when trailing cells are empty
+            item_name = row[name_idx] if name_idx < len(row) else None
+            sql = row[sql_idx] if sql_idx < len(row) else None
+            if item_name is None or sql is None:
+                continue
+            item_name = str(item_name).strip()
+            sql = str(sql).strip()
+            if not item_name or not sql:
+                continue
+            safe_item_name = item_name.translate(_FNAME_TRANS)
+
+            # Get unique file path in the subfolder
+            sql_path = get_unique_filename(package_output_folder, safe_item_name, "sql", used)
+
+            # Write to .sql file
+            with open(sql_path, "w", encoding="utf-8", buffering=1 << 20) as f:
+                f.write(sql)
+
+            messages.append(f"    ✅ Extracted SQL to: {sql_path}")
+    finally:
+        wb.close()
+
+    return messages
+
+def main():
+    # --- USER INPUT ---
+    input_folder = input("Enter the path to the folder containing the Excel (.xlsx) files: ").strip('"').strip()
+    output_root_folder = input("Enter the path to the output folder where SQL files should be saved: ").strip('"').strip()
 
-            if item_name and sql:
-                # Clean the item name to use in filename
-                safe_item_name = item_name.replace(" ", "_").replace("/", "_").replace("\\", "_").replace(":", "_")
-                filename_base = f"{safe_item_name}"
+    # Validate input folder
+    if not os.path.exists(input_folder):
+        print(f"❌ ERROR: Input folder not found: {input_folder}")
+        exit(1)
 
-                # Get unique file path in the subfolder
-                sql_path = get_unique_filename(package_output_folder, filename_base, "sql")
+    # Create output root folder if it doesn't exist
+    os.makedirs(output_root_folder, exist_ok=True)
 
-                # Write to .sql file
-                with open(sql_path, "w", encoding="utf-8") as f:
-                    f.write(sql)
+    # Process each Excel file; workbooks are independent, so they are parsed in parallel processes
+    xlsx_paths = [os.path.join(input_folder, filename)
+                  for filename in os.listdir(input_folder) if filename.endswith(".xlsx")]
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for messages in executor.map(partial(_process_xlsx, output_root_folder=output_root_folder), xlsx_paths):
+            print("\n".join(messages))
 
-                print(f"    ✅ Extracted SQL to: {sql_path}")
+    print("\n🎉 All done! SQLs saved per DTSX package folder.")
 
-print("\n🎉 All done! SQLs saved per DTSX package folder.")
+if __name__ == "__main__":
+    main()
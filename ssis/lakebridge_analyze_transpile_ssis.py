@@ -1,78 +1,26 @@
 import argparse
+import asyncio
+import os
 import shutil
-import subprocess
 import sys
 from pathlib import Path
 from datetime import datetime
-import sqlparse
 import tempfile
 
-def check_cli():
-    if shutil.which("databricks") is None:
-        sys.exit("ERROR: 'databricks' CLI not found in PATH. Install/configure it and try again.")
-
-def ensure_dirs(folder: Path):
-    folder.mkdir(parents=True, exist_ok=True)
-
-def run_cmd(cmd_str: str, title: str, capture_output=False):
-    print(f"\n=== {title} ===")
-    print("Command:", cmd_str)
-    try:
-        result = subprocess.run(cmd_str, shell=True, timeout=1800, capture_output=capture_output, text=True)
-        if result.returncode != 0:
-            if capture_output:
-                return False, result.stdout, result.stderr
-            else:
-                sys.exit(f"{title} failed with exit code {result.returncode}")
-        if capture_output:
-            return True, result.stdout, result.stderr
-        return True, None, None
-    except subprocess.TimeoutExpired:
-        sys.exit(f"{title} timed out after 1800 seconds")
-
-def process_sql_files(converted_folder: Path, notebooks_folder: Path):
-    final_folder = converted_folder.parent / "Final_Formatted"
-    ensure_dirs(final_folder)
-    ensure_dirs(notebooks_folder)
-
-    for sql_file in converted_folder.glob("*.sql"):
-        with open(sql_file, "r", encoding="utf-8") as f:
-            sql_content = f.read()
-
-        # Format SQL
-        sql_content = sqlparse.format(sql_content, reindent=True, keyword_case="upper")
-
-        # Save formatted SQL
-        final_file = final_folder / sql_file.name
-        with open(final_file, "w", encoding="utf-8") as f:
-            f.write(sql_content)
-
-        # Create Databricks notebook (.py)
-        notebook_file = notebooks_folder / (sql_file.stem + ".py")
-        with open(notebook_file, "w", encoding="utf-8") as f:
-            f.write("# Databricks notebook source\n")
-            f.write(f'"""\nAuto-generated from {sql_file.name}\n"""\n\n')
-            f.write('sql_query = """\n')
-            f.write(sql_content)
-            f.write('\n"""\n')
-            f.write("display(spark.sql(sql_query))\n")
-
-        # Upload notebook
-        upload_cmd = (
-            f'databricks workspace import '
-            f'--file "{notebook_file}" '
-            f'"/Shared/{notebook_file.name}" '
-            f'--language PYTHON --overwrite'
-        )
-        run_cmd(upload_cmd, f"Upload Notebook {notebook_file.name}")
+# Shared helpers live in lakebridge_common.py at the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from lakebridge_common import CLI_WORKERS, DATABRICKS_BIN, check_cli, ensure_dirs, process_sql_files, run_cmd_async
 
-def main():
+async def main():
     parser = argparse.ArgumentParser(description="Run Lakebridge Analyze and Convert (Transpile) commands.")
     parser.add_argument("--source-path", help="Folder (or file) used for analyze/transpile --source-directory")
     parser.add_argument("--target-path", help="Folder where analyzer report and converted code will be saved")
     parser.add_argument("--dialect", help="Source dialect/tech (e.g., synapse, oracle, teradata)")
     parser.add_argument("--profile", help="Optional Databricks CLI profile name (maps to -p/--profile)")
     parser.add_argument("--debug", action="store_true", help="Enable Lakebridge debug logging (--debug)")
+    parser.add_argument("--workers", type=int, default=CLI_WORKERS, help="Number of Lakebridge CLI calls to run concurrently")
+    parser.add_argument("--force-upload", action="store_true",
+                        help="Re-upload every notebook, including files already uploaded unchanged")
     args = parser.parse_args()
 
     source_path = args.source_path or input('Enter source path (folder or file): ').strip('"').strip()
@@ -103,31 +51,46 @@ def main():
             dtsx_files = [source_path_obj]
         else:
             sys.exit("ERROR: Provided file is not a .dtsx file.")
+        source_sql_files = [p for p in [source_path_obj.with_suffix(".sql")] if p.exists()]
     else:
-        # Folder, get all .dtsx files inside
-        dtsx_files = list(source_path_obj.glob("*.dtsx"))
+        # Folder: one listing serves both the .dtsx files and the .sql lookups below
+        with os.scandir(source_path_obj) as entries:
+            source_files = sorted(Path(entry.path) for entry in entries if entry.is_file())
+        dtsx_files = [p for p in source_files if p.suffix.lower() == ".dtsx"]
+        source_sql_files = [p for p in source_files if p.suffix.lower() == ".sql"]
         if not dtsx_files:
             sys.exit("ERROR: No .dtsx files found in the source folder.")
 
-    # 1️⃣ Run Analyzer separately for each dtsx file by copying into temp dir
-    for dtsx_file in dtsx_files:
-        print(f"\n=== Lakebridge Analyze {dtsx_file.name} ===")
+    run_ts = datetime.now().strftime("%Y%m%d_%H%M%S")
 
+    # Caps concurrent databricks CLI processes; all of them are driven from this one event loop
+    cli_limit = asyncio.Semaphore(args.workers)
+
+    # 1️⃣ Run Analyzer separately for each dtsx file by copying into temp dir
+    async def _analyze_one(dtsx_file: Path):
         with tempfile.TemporaryDirectory(dir=target_folder) as temp_dir:
             temp_path = Path(temp_dir)
             shutil.copy(dtsx_file, temp_path / dtsx_file.name)
 
-            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            report_file = target_folder / f"lakebridge_analysis_{dtsx_file.stem}_{ts}.xlsx"
+            report_file = target_folder / f"lakebridge_analysis_{dtsx_file.stem}_{run_ts}.xlsx"
 
-            analyze_cmd_parts = [
-                "databricks labs lakebridge analyze",
-                f'--source-directory "{temp_path}"',
-                f'--report-file "{report_file}"',
-                f'--source-tech SSIS',  # Hardcoded exactly as SSIS to avoid prompt
-            ] + global_flags
+            analyze_argv = [
+                DATABRICKS_BIN, "labs", "lakebridge", "analyze",
+                "--source-directory", str(temp_path),
+                "--report-file", str(report_file),
+                "--source-tech", "SSIS",  # Hardcoded exactly as SSIS to avoid prompt
+                *global_flags,
+            ]
 
-            run_cmd(" ".join(analyze_cmd_parts), f"Lakebridge Analyze {dtsx_file.name}")
+            success, _, error = await run_cmd_async(
+                analyze_argv, f"Lakebridge Analyze {dtsx_file.name}", cli_limit, timeout=1800, ignore_failure=True,
+            )
+            return success, error
+
+    # Each package is analyzed from its own temp dir, so the CLI calls are independent
+    for success, error in await asyncio.gather(*(_analyze_one(dtsx_file) for dtsx_file in dtsx_files)):
+        if not success:
+            sys.exit(error)
 
     # 2️⃣ Run Converter (Transpile) for all SQL files after analyze completes
     converted_folder = target_folder / "Converted_Code"
@@ -135,40 +98,46 @@ def main():
 
     # Find all .sql files in source_path or converted_folder for transpile
     # Assuming dtsx files transpile to SQL elsewhere, we look for .sql files in source_path folder
-    sql_files = []
-    for dtsx_file in dtsx_files:
-        sql_candidate = dtsx_file.with_suffix(".sql")
-        if sql_candidate.exists():
-            sql_files.append(sql_candidate)
+    source_sql_set = set(source_sql_files)
+    sql_files = [dtsx_file.with_suffix(".sql") for dtsx_file in dtsx_files
+                 if dtsx_file.with_suffix(".sql") in source_sql_set]
     # If none found by that, fallback to all sql in source folder
     if not sql_files:
-        sql_files = list(source_path_obj.glob("*.sql"))
-
-    successful_transpiles = 0
-    for sql_file in sql_files:
-        print(f"\n=== Transpile {sql_file.name} ===")
-        transpile_cmd = (
-            f'databricks labs lakebridge transpile '
-            f'--input-source "{sql_file}" '
-            f'--source-dialect {dialect_transpile} '
-            f'--output-folder "{converted_folder}" '
+        sql_files = source_sql_files
+
+    async def _transpile_one(sql_file: Path):
+        transpile_argv = [
+            DATABRICKS_BIN, "labs", "lakebridge", "transpile",
+            "--input-source", str(sql_file),
+            "--source-dialect", dialect_transpile,
+            "--output-folder", str(converted_folder),
+            *global_flags,
+        ]
+        success, stdout, stderr = await run_cmd_async(
+            transpile_argv, f"Transpile {sql_file.name}", cli_limit, timeout=1800, ignore_failure=True,
+            capture_output=True,
         )
-        if global_flags:
-            transpile_cmd += " " + " ".join(global_flags)
-
-        success, stdout, stderr = run_cmd(transpile_cmd, f"Transpile {sql_file.name}", capture_output=True)
+        # Reported as each transpile lands rather than after the whole batch
         if not success:
             print(f"⚠️ Transpile failed for {sql_file.name}: {stderr.strip()}")
         else:
-            successful_transpiles += 1
             print(stdout.strip())
+        return success
+
+    successful_transpiles = sum(await asyncio.gather(*(_transpile_one(sql_file) for sql_file in sql_files)))
 
     if successful_transpiles == 0:
         print("WARNING: No files transpiled successfully.")
 
     # 3️⃣ Post-process SQL + Generate Notebooks
     notebooks_folder = target_folder / "Databricks_Notebooks"
-    process_sql_files(converted_folder, notebooks_folder)
+    metadata_folder = target_folder / "metadata"
+    ensure_dirs(metadata_folder)
+    # CPU-bound formatting and blocking uploads run off the event loop.
+    # The cache lives under the target folder (the runner's metadata layout): it is shared with the runner only when
+    # both use the same target folder, which then also means the same Converted_Code and notebooks.
+    await asyncio.to_thread(process_sql_files, converted_folder, notebooks_folder,
+                            format_cache_file=metadata_folder / "format_cache.json", force_upload=args.force_upload)
 
     print("\nAll done ✅")
     print(f"Analyzer reports saved in: {target_folder}")
@@ -177,5 +146,5 @@ def main():
     print(f"Databricks notebooks saved at: {notebooks_folder} and uploaded to /Shared in workspace")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
 
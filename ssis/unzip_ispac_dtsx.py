@@ -1,7 +1,9 @@
+import io
+import json
 import os
 import zipfile
+import zlib
 import shutil
-import tempfile
 
 # --- USER INPUT ---
 zip_path = input("Enter the full path of the zip file (.zip): ").strip()
@@ -10,46 +12,92 @@ output_dir = input("Enter the directory to save extracted .dtsx files: ").strip(
 # Create output directory if it doesn't exist
 os.makedirs(output_dir, exist_ok=True)
 
-# Step 1: Create a temp directory for unzipping the outer .zip
-with tempfile.TemporaryDirectory() as temp_dir:
-    print(f"🔓 Unzipping outer zip: {zip_path}")
-    with zipfile.ZipFile(zip_path, 'r') as outer_zip:
-        outer_zip.extractall(temp_dir)
+# Names already taken in output_dir (normcased), so uniqueness is checked in memory rather than per-candidate stat
+used = {os.path.normcase(name) for name in os.listdir(output_dir)}
 
-    print(f"✅ Extracted outer zip to temp folder: {temp_dir}")
+# Files from earlier runs not yet matched to an entry; only these can make an entry count as unchanged
+previous_files = set(used)
+
+# CRC32 of each extracted file, so a rerun can tell an unchanged .dtsx without re-reading it
+crc_cache_file = os.path.join(output_dir, '.dtsx_crc_cache.json')
+try:
+    with open(crc_cache_file, 'r', encoding='utf-8') as f:
+        crc_cache = json.load(f)
+except (OSError, ValueError):
+    crc_cache = {}
+
+def existing_crc(dest_file):
+    """CRC32 of an already extracted file; the cached value is used while the file is untouched since it was recorded."""
+    path = os.path.join(output_dir, dest_file)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    entry = crc_cache.get(dest_file)
+    if entry and entry['mtime_ns'] == mtime_ns:
+        return entry['crc']
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            crc = zlib.crc32(chunk, crc)
+    crc_cache[dest_file] = {'crc': crc, 'mtime_ns': mtime_ns}
+    return crc
+
+# Step 1: Open the outer .zip and look for .ispac entries directly in its listing (nothing is extracted to disk)
+print(f"🔓 Opening outer zip: {zip_path}")
+with zipfile.ZipFile(zip_path, 'r') as outer_zip:
     print("🔍 Scanning for .ispac files...")
 
-    # Step 2: Walk through all folders to find .ispac files
-    for root, dirs, files in os.walk(temp_dir):
-        for file in files:
-            if file.lower().endswith('.ispac'):
-                ispac_path = os.path.join(root, file)
-                print(f"📦 Found .ispac: {ispac_path}")
-
-                # Step 3: Open the .ispac as a zip file
-                try:
-                    with zipfile.ZipFile(ispac_path, 'r') as ispac_zip:
-                        for name in ispac_zip.namelist():
-                            if name.lower().endswith('.dtsx'):
-                                # Extract and save with unique filename
-                                base_name = os.path.splitext(file)[0]
-                                dtsx_name = os.path.basename(name)
-                                dest_file = f"{base_name}_{dtsx_name}"
-
-                                # Ensure uniqueness
-                                counter = 1
-                                final_path = os.path.join(output_dir, dest_file)
-                                while os.path.exists(final_path):
-                                    dest_file = f"{base_name}_{counter}_{dtsx_name}"
-                                    final_path = os.path.join(output_dir, dest_file)
-                                    counter += 1
-
-                                with ispac_zip.open(name) as dtsx_file, open(final_path, 'wb') as out_file:
-                                    shutil.copyfileobj(dtsx_file, out_file)
-
-                                print(f"    ➤ Extracted: {dest_file}")
-
-                except zipfile.BadZipFile:
-                    print(f"❌ Skipping invalid .ispac (not a zip): {ispac_path}")
+    # Step 2: Go through the .ispac entries of the outer zip
+    for ispac_name in outer_zip.namelist():
+        if not ispac_name.lower().endswith('.ispac'):
+            continue
+        print(f"📦 Found .ispac: {ispac_name}")
+        file = os.path.basename(ispac_name)
+
+        # Step 3: Open the .ispac as a zip file, held in memory only while its .dtsx entries are copied out
+        try:
+            with outer_zip.open(ispac_name) as fp:
+                ispac_data = io.BytesIO(fp.read())
+            with zipfile.ZipFile(ispac_data, 'r') as ispac_zip:
+                for info in ispac_zip.infolist():
+                    name = info.filename
+                    if name.lower().endswith('.dtsx'):
+                        # Extract and save with unique filename
+                        base_name = os.path.splitext(file)[0]
+                        dtsx_name = os.path.basename(name)
+                        dest_file = f"{base_name}_{dtsx_name}"
+
+                        # Ensure uniqueness; a file from an earlier run holding the same content (zip CRC) means this
+                        # entry is already extracted. Each such file is matched once, so duplicates keep their own names.
+                        counter = 1
+                        unchanged = False
+                        while os.path.normcase(dest_file) in used:
+                            if os.path.normcase(dest_file) in previous_files and existing_crc(dest_file) == info.CRC:
+                                previous_files.discard(os.path.normcase(dest_file))
+                                unchanged = True
+                                break
+                            dest_file = f"{base_name}_{counter}_{dtsx_name}"
+                            counter += 1
+                        if unchanged:
+                            print(f"    ⏭️ Unchanged: {dest_file}")
+                            continue
+                        used.add(os.path.normcase(dest_file))
+                        final_path = os.path.join(output_dir, dest_file)
+
+                        # 1 MiB chunks: far fewer read()/write() calls than the 16 KiB default on large packages
+                        with ispac_zip.open(name) as dtsx_file, open(final_path, 'wb', buffering=1 << 20) as out_file:
+                            shutil.copyfileobj(dtsx_file, out_file, length=1 << 20)
+                        crc_cache[dest_file] = {'crc': info.CRC, 'mtime_ns': os.stat(final_path).st_mtime_ns}
+
+                        print(f"    ➤ Extracted: {dest_file}")
+
+        except zipfile.BadZipFile:
+            print(f"❌ Skipping invalid .ispac (not a zip): {ispac_name}")
+        finally:
+            ispac_data = None
+
+with open(crc_cache_file, 'w', encoding='utf-8') as f:
+    json.dump(crc_cache, f)
 
 print(f"\n🎉 Done! All .dtsx files are in: {output_dir}")